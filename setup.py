@@ -34,7 +34,7 @@ software_licence = readfile("LICENSE")
 requires = [
     'cmlibs.argon >= 0.4.0',
     'cmlibs.zinc',
-    'svgpathtools_light',
+    'numpy',
 ]
 
 setup(
@@ -57,6 +57,7 @@ setup(
     extras_require={
         "thumbnail_hardware": ["PySide6"],
         "thumbnail_software": ["PyOpenGL"],
+        "fast_json": ["orjson"],
     }
 
 )
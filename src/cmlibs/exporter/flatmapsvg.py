@@ -6,18 +6,19 @@ import json
 import os
 import random
 
-from svgpathtools import svg2paths
-from xml.dom.minidom import parseString
+import numpy as np
 
 from cmlibs.zinc.field import Field
 from cmlibs.zinc.result import RESULT_OK
 
 from cmlibs.exporter.base import BaseExporter
-from cmlibs.maths.vectorops import sub, div, add
 from cmlibs.utils.zinc.field import get_group_list
 from cmlibs.utils.zinc.general import ChangeManager
 
 
+MARKER_RADIUS = 3
+
+
 class ArgonSceneExporter(BaseExporter):
     """
     Export a visualisation described by an Argon document to webGL.
@@ -77,14 +78,7 @@ class ArgonSceneExporter(BaseExporter):
         bezier = _calculate_bezier_control_points(path_points)
         markers = _calculate_markers(region, "coordinates")
         svg_string = _write_into_svg_format(bezier, markers)
-        paths, attributes = svg2paths(svg_string)
-        bbox = [999999999, -999999999, 999999999, -999999999]
-        for p in paths:
-            path_bbox = p.bbox()
-            bbox[0] = min(path_bbox[0], bbox[0])
-            bbox[1] = max(path_bbox[1], bbox[1])
-            bbox[2] = min(path_bbox[2], bbox[2])
-            bbox[3] = max(path_bbox[3], bbox[3])
+        bbox = _calculate_bounding_box(bezier, markers)
 
         view_margin = 10
         view_box = (int(bbox[0] + 0.5) - view_margin,
@@ -94,22 +88,17 @@ class ArgonSceneExporter(BaseExporter):
 
         svg_string = svg_string.replace('viewBox="WWW XXX YYY ZZZ"', f'viewBox="{view_box[0]} {view_box[1]} {view_box[2]} {view_box[3]}"')
 
-        svg_string = parseString(svg_string).toprettyxml()
-
         features = {}
-        centreline_names = []
+        centrelines = []
         for path_key in path_points:
             if path_key.endswith('_name'):
-                centreline_names.append(path_key)
                 features[path_key] = {
                     "label": path_points[path_key],
                     "type": "centreline",
                 }
+                centrelines.append({"id": path_key})
 
         networks = []
-        centrelines = []
-        for centreline_name in centreline_names:
-            centrelines.append({"id": centreline_name})
 
         # May at some point be able to describe the connectivity between centrelines.
         # networks.append({"centrelines": centrelines})
@@ -127,8 +116,15 @@ class ArgonSceneExporter(BaseExporter):
         with open(f'{os.path.join(self._output_target, self._prefix)}.svg', 'w') as f:
             f.write(svg_string)
 
-        with open(os.path.join(self._output_target, 'properties.json'), 'w') as f:
-            json.dump(properties, f, default=lambda o: o.__dict__, sort_keys=True, indent=2)
+        properties_file = os.path.join(self._output_target, 'properties.json')
+        try:
+            import orjson
+
+            with open(properties_file, 'wb') as f:
+                f.write(orjson.dumps(properties, default=lambda o: o.__dict__, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+        except ImportError:
+            with open(properties_file, 'w') as f:
+                json.dump(properties, f, default=lambda o: o.__dict__, sort_keys=True, indent=2)
 
 
 def _calculate_markers(region, coordinate_field_name):
@@ -152,6 +148,9 @@ def _calculate_markers(region, coordinate_field_name):
         marker_iterator = marker_datapoints.createNodeiterator()
         components_count = coordinate_field.getNumberOfComponents()
 
+        has_name = name_field.isValid()
+        has_id = id_field.isValid()
+
         marker = marker_iterator.next()
         fc = fm.createFieldcache()
 
@@ -159,12 +158,12 @@ def _calculate_markers(region, coordinate_field_name):
         while marker.isValid():
             fc.setNode(marker)
             result, values = coordinate_field.evaluateReal(fc, components_count)
-            if name_field.isValid():
+            if has_name:
                 name = name_field.evaluateString(fc)
             else:
                 name = f"Unnamed marker {i + 1}"
 
-            if id_field.isValid():
+            if has_id:
                 onto_id = id_field.evaluateString(fc)
             else:
                 rand_num = random.randint(1, 99999)
@@ -188,114 +187,171 @@ def _analyze_elements(region, coordinate_field_name):
         return []
 
     group_list = get_group_list(fm)
-    group_index = 0
-    grouped_path_points = {
-        "ungrouped": []
-    }
-    for group in group_list:
+    group_info = []
+    # Map each element identifier to the row lists of the groups it is in.
+    memberships = {}
+    for group_index, group in enumerate(group_list):
         group_name = group.getName()
         if group_name != "marker":
-            group_label = f"group_{group_index + 1}"
-            grouped_path_points[group_label] = []
-            grouped_path_points[f"{group_label}_name"] = group_name
-        group_index += 1
+            group_rows = []
+            group_info.append((f"group_{group_index + 1}", group_name, group_rows))
+            group_iterator = group.getMeshGroup(mesh).createElementiterator()
+            element = group_iterator.next()
+            while element.isValid():
+                memberships.setdefault(element.getIdentifier(), []).append(group_rows)
+                element = group_iterator.next()
+
+    ungrouped_rows = []
     el_iterator = mesh.createElementiterator()
 
     with ChangeManager(fm):
         xi_1_derivative = fm.createFieldDerivative(coordinates, 1)
+        fc = fm.createFieldcache()
+        # Each row holds [[values_1, derivatives_1], [values_2, derivatives_2]] for an element.
+        line_path_points = np.empty((mesh.getSize(), 2, 2, coordinates.getNumberOfComponents()))
+        row = 0
         element = el_iterator.next()
         while element.isValid():
-            values_1 = _evaluate_field_data(element, 0, coordinates)
-            values_2 = _evaluate_field_data(element, 1, coordinates)
-            derivatives_1 = _evaluate_field_data(element, 0, xi_1_derivative)
-            derivatives_2 = _evaluate_field_data(element, 1, xi_1_derivative)
-
-            line_path_points = None
-            if values_1 and values_2 and derivatives_1 and derivatives_2:
-                line_path_points = [(values_1, derivatives_1), (values_2, derivatives_2)]
-
-            if line_path_points is not None:
-                group_index = 0
-                in_group = False
-                for group in group_list:
-                    mesh_group = group.getMeshGroup(mesh)
-                    if mesh_group.containsElement(element):
-                        group_label = f"group_{group_index + 1}"
-                        grouped_path_points[group_label].append(line_path_points)
-                        in_group = True
-
-                    group_index += 1
-
-                if not in_group:
-                    grouped_path_points["ungrouped"].append(line_path_points)
+            if _evaluate_field_data(element, (coordinates, xi_1_derivative), fc, line_path_points[row]):
+                for group_rows in memberships.get(element.getIdentifier(), (ungrouped_rows,)):
+                    group_rows.append(row)
+
+                row += 1
 
             element = el_iterator.next()
 
+        del fc
         del xi_1_derivative
 
-    return grouped_path_points
-
+    grouped_path_points = {
+        "ungrouped": line_path_points[ungrouped_rows]
+    }
+    for group_label, group_name, group_rows in group_info:
+        grouped_path_points[group_label] = line_path_points[group_rows]
+        grouped_path_points[f"{group_label}_name"] = group_name
 
-def _evaluate_field_data(element, xi, data_field):
-    mesh = element.getMesh()
-    fm = mesh.getFieldmodule()
-    fc = fm.createFieldcache()
+    return grouped_path_points
 
-    components_count = data_field.getNumberOfComponents()
 
-    fc.setMeshLocation(element, xi)
-    result, values = data_field.evaluateReal(fc, components_count)
-    if result == RESULT_OK:
-        return values
+def _evaluate_field_data(element, data_fields, fc, path_points):
+    """
+    Evaluate the data fields at both ends of a line element into *path_points*,
+    an array of shape (2, len(data_fields), components count).
 
-    return None
+    :return: True if all the data fields were evaluated, False otherwise.
+    """
+    components_count = path_points.shape[-1]
+    for end, xi in enumerate((0.0, 1.0)):
+        fc.setMeshLocation(element, xi)
+        for field_index, data_field in enumerate(data_fields):
+            result, values = data_field.evaluateReal(fc, components_count)
+            if result != RESULT_OK:
+                return False
 
+            path_points[end, field_index] = values
 
-def _calculate_bezier_curve(pt_1, pt_2):
-    h0 = pt_1[0][:2]
-    v0 = pt_1[1][:2]
-    h1 = pt_2[0][:2]
-    v1 = pt_2[1][:2]
+    return True
 
-    b0 = h0
-    b1 = add(h0, div(v0, 3))
-    b2 = sub(h1, div(v1, 3))
-    b3 = h1
 
-    return b0, b1, b2, b3
+def _as_complex(pts):
+    """
+    Convert an array of 2D points into an array of complex numbers, the x component becomes
+    the real part and the y component the imaginary part.
+    """
+    return pts[..., 0] + 1j * pts[..., 1]
 
 
 def _calculate_bezier_control_points(point_data):
     bezier = {}
 
     for point_group in point_data:
-        if point_data[point_group] and not point_group.endswith("_name"):
-            bezier[point_group] = []
-            for curve_pts in point_data[point_group]:
-                bezier[point_group].append(_calculate_bezier_curve(curve_pts[0], curve_pts[1]))
+        if not point_group.endswith("_name") and len(point_data[point_group]):
+            curve_pts = np.asarray(point_data[point_group])
+            h0 = curve_pts[:, 0, 0, :2]
+            v0 = curve_pts[:, 0, 1, :2]
+            h1 = curve_pts[:, 1, 0, :2]
+            v1 = curve_pts[:, 1, 1, :2]
+
+            b1 = h0 + v0 / 3
+            b2 = h1 - v1 / 3
+
+            bezier[point_group] = _as_complex(np.stack((h0, b1, b2, h1), axis=1))
 
     return bezier
 
 
-def _write_svg_bezier_path(bezier_path, ungrouped=False):
-    svg = ''
-    for i in range(len(bezier_path)):
-        b = bezier_path[i]
-        stroke = "blue" if ungrouped else "white"
-        svg += f'<path d="M {b[0][0]} {b[0][1]} C {b[1][0]} {b[1][1]}, {b[2][0]} {b[2][1]}, {b[3][0]} {b[3][1]}" stroke="{stroke}"/>'
+def _cubic_bezier_extent(control_values):
+    """
+    Calculate the minimum and maximum values reached by a set of cubic Bezier curves
+    for a single coordinate. The turning points of each curve are found by solving
+    the derivative of the curve for t in (0, 1).
 
-    return svg
+    :param control_values: Array of shape (N, 4) of the control point values.
+    :return: Tuple of the minimum and maximum value.
+    """
+    p0, p1, p2, p3 = control_values.T
+    a = p1 - p0
+    b = p2 - p1
+    c = p3 - p2
+    # The derivative is proportional to qa * t^2 + qb * t + qc.
+    qa = a - 2 * b + c
+    qb = 2 * (b - a)
+    qc = a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        root_discriminant = np.sqrt(qb * qb - 4 * qa * qc)
+        t_1 = np.where(qa == 0, -qc / qb, (-qb + root_discriminant) / (2 * qa))
+        t_2 = np.where(qa == 0, np.nan, (-qb - root_discriminant) / (2 * qa))
+
+    t = np.stack((t_1, t_2), axis=1)
+    # Turning points outside of the curve are replaced by the start point, which is already included.
+    t = np.where((t > 0) & (t < 1), t, 0)
+    mt = 1 - t
+    turning_values = mt ** 3 * p0[:, None] + 3 * mt ** 2 * t * p1[:, None] + 3 * mt * t ** 2 * p2[:, None] + t ** 3 * p3[:, None]
+
+    values = np.concatenate((control_values[:, [0, 3]], turning_values), axis=1)
+    return values.min(), values.max()
+
+
+def _calculate_bounding_box(bezier_data, markers):
+    """
+    Calculate the bounding box of the Bezier curves and marker circles that make up the SVG.
+
+    :return: List of [x_min, x_max, y_min, y_max].
+    """
+    bbox = [999999999, -999999999, 999999999, -999999999]
+    if bezier_data:
+        control_points = np.concatenate(list(bezier_data.values()))
+        x_min, x_max = _cubic_bezier_extent(control_points.real)
+        y_min, y_max = _cubic_bezier_extent(control_points.imag)
+        bbox = [x_min, x_max, y_min, y_max]
+
+    for marker in markers:
+        try:
+            bbox[0] = min(marker[1][0] - MARKER_RADIUS, bbox[0])
+            bbox[1] = max(marker[1][0] + MARKER_RADIUS, bbox[1])
+            bbox[2] = min(marker[1][1] - MARKER_RADIUS, bbox[2])
+            bbox[3] = max(marker[1][1] + MARKER_RADIUS, bbox[3])
+        except IndexError:
+            pass
+
+    return bbox
 
 
 class UnionFind:
     def __init__(self, v):
-        self.parent = [-1 for _ in range(v)]
+        self.parent = [-1] * v
 
     def find(self, i):
-        if self.parent[i] == -1:
-            return i
-        self.parent[i] = self.find(self.parent[i])  # Path compression
-        return self.parent[i]
+        parent = self.parent
+        root = i
+        while parent[root] != -1:
+            root = parent[root]
+
+        # Path compression.
+        while parent[i] != -1 and parent[i] != root:
+            parent[i], i = root, parent[i]
+
+        return root
 
     def union(self, i, j):
         root_i = self.find(i)
@@ -310,8 +366,12 @@ class UnionFind:
 
 
 def _create_key(pt):
-    tolerance = 1e12
-    return int(pt[0] * tolerance), int(pt[1] * tolerance)
+    """
+    Create a key for a point by truncating each coordinate to the tolerance and
+    packing the two 32 bit values into a single integer.
+    """
+    tolerance = 1e6
+    return (int(pt.real * tolerance) & 0xFFFFFFFF) << 32 | (int(pt.imag * tolerance) & 0xFFFFFFFF)
 
 
 def _connected_segments(curve):
@@ -323,33 +383,61 @@ def _connected_segments(curve):
         begin_hash[key] = index
 
     curve_size = len(curve)
-    uf = UnionFind(len(curve))
+    following = [None] * curve_size
+    preceding = [None] * curve_size
+    branching = False
     for index, c in enumerate(curve):
-        y_cur = _create_key(c[3])
-        if y_cur in begin_hash:
-            uf.union(begin_hash[y_cur], index)
+        next_index = begin_hash.get(_create_key(c[3]))
+        if next_index is not None and next_index != index:
+            if preceding[next_index] is not None:
+                branching = True
+            following[index] = next_index
+            preceding[next_index] = index
 
-    sets = {}
-    for i in range(curve_size):
-        root = uf.find(i)
-        if root not in sets:
-            sets[root] = []
+    if branching:
+        return _union_find_segments(curve, following)
 
-        sets[root].append(i)
+    segments = []
+    visited = [False] * curve_size
+    for index in range(curve_size):
+        if visited[index]:
+            continue
+
+        # Step back to the head of the chain, a closed loop has no head so start from the current curve.
+        head = index
+        while preceding[head] is not None:
+            head = preceding[head]
+            if head == index:
+                break
+
+        seg = []
+        while head is not None and not visited[head]:
+            visited[head] = True
+            seg.append(curve[head])
+            head = following[head]
+
+        segments.append(seg)
+
+    return segments
+
+
+def _union_find_segments(curve, following):
+    curve_size = len(curve)
+    uf = UnionFind(curve_size)
+    for index in range(curve_size):
+        if following[index] is not None:
+            uf.union(following[index], index)
+
+    # Only the set roots are needed, in the order they are first found.
+    roots = dict.fromkeys(uf.find(i) for i in range(curve_size))
 
     segments = []
-    for s in sets:
+    for s in roots:
         seg = [curve[s]]
-        key = _create_key(curve[s][3])
-        while key in begin_hash:
-            s = begin_hash[key]
+        s = following[s]
+        while s is not None:
             seg.append(curve[s])
-            old_key = key
-            key = _create_key(curve[s][3])
-            if old_key == key:
-                print("Breaking out of loop.")
-                break
-            # print(key)
+            s = following[s]
 
         segments.append(seg)
 
@@ -357,50 +445,38 @@ def _connected_segments(curve):
 
 
 def _write_connected_svg_bezier_path(bezier_path, ungrouped=False):
-    svg = ''
     stroke = "blue" if ungrouped else "white"
+    start = bezier_path[0][0]
+    curves = ''.join([f' C {b[1].real} {b[1].imag}, {b[2].real} {b[2].imag}, {b[3].real} {b[3].imag}' for b in bezier_path])
 
-    for i in range(len(bezier_path)):
-        b = bezier_path[i]
-        if i == 0:
-            svg += f'<path d="M {b[0][0]} {b[0][1]}'
-
-        svg += f' C {b[1][0]} {b[1][1]}, {b[2][0]} {b[2][1]}, {b[3][0]} {b[3][1]}'
-    svg += f'" stroke="{stroke}" fill="transparent"/>'
-
-    return svg
+    return f'<path d="M {start.real} {start.imag}{curves}" stroke="{stroke}" fill="transparent"/>'
 
 
 def _write_into_svg_format(bezier_data, markers):
-    svg = '<svg width="1000" height="1000" viewBox="WWW XXX YYY ZZZ" xmlns="http://www.w3.org/2000/svg">'
+    svg = [
+        '<?xml version="1.0" ?>',
+        '<svg xmlns="http://www.w3.org/2000/svg" width="1000" height="1000" viewBox="WWW XXX YYY ZZZ">',
+    ]
     for group_name in bezier_data:
-        connected_paths = _connected_segments(bezier_data[group_name])
+        connected_paths = _connected_segments(bezier_data[group_name].tolist())
         if group_name == "ungrouped":
             for connected_bezier_data in connected_paths:
-                svg += _write_connected_svg_bezier_path(connected_bezier_data, ungrouped=True)
+                svg.append(f'\t{_write_connected_svg_bezier_path(connected_bezier_data, ungrouped=True)}')
         else:
-            svg += f'<g><title>.centreline id({group_name}_name)</title>'
+            svg.append('\t<g>')
+            svg.append(f'\t\t<title>.centreline id({group_name}_name)</title>')
             for connected_bezier_data in connected_paths:
-                svg += _write_connected_svg_bezier_path(connected_bezier_data)
-            svg += f'</g>'
-
-    # for i in range(len(bezier_path)):
-    #     b = bezier_path[i]
-    #     svg += f'<circle cx="{b[0][0]}" cy="{b[0][1]}" r="2" fill="green"/>\n'
-    #     svg += f'<circle cx="{b[1][0]}" cy="{b[1][1]}" r="1" fill="yellow"/>\n'
-    #     svg += f'<circle cx="{b[2][0]}" cy="{b[2][1]}" r="1" fill="purple"/>\n'
-    #     svg += f'<circle cx="{b[3][0]}" cy="{b[3][1]}" r="2" fill="brown"/>\n'
-    #     svg += f'<path d="M {b[0][0]} {b[0][1]} L {b[1][0]} {b[1][1]}" stroke="pink"/>\n'
-    #     svg += f'<path d="M {b[3][0]} {b[3][1]} L {b[2][0]} {b[2][1]}" stroke="orange"/>\n'
+                svg.append(f'\t\t{_write_connected_svg_bezier_path(connected_bezier_data)}')
+            svg.append('\t</g>')
 
     for marker in markers:
         try:
-            svg += f'<circle cx="{marker[1][0]}" cy="{marker[1][1]}" r="3" fill-opacity="0.0">'
-            svg += f'<title>.id({marker[0]})</title>'
-            svg += '</circle>'
+            svg.append(f'\t<circle cx="{marker[1][0]}" cy="{marker[1][1]}" r="{MARKER_RADIUS}" fill-opacity="0.0">\n'
+                       f'\t\t<title>.id({marker[0]})</title>\n'
+                       '\t</circle>')
         except IndexError:
             print("Invalid marker for export:", marker)
 
-    svg += '</svg>'
+    svg.append('</svg>\n')
 
-    return svg
+    return '\n'.join(svg)
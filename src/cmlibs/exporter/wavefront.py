@@ -1,7 +1,6 @@
 """
 Export an Argon document to Wavefront documents.
 """
-import math
 import re
 
 from cmlibs.argon.argondocument import ArgonDocument
@@ -84,7 +83,7 @@ class ArgonSceneExporter(BaseExporter):
 
         scene.write(sceneSR)
 
-        number_of_digits = math.floor(math.log10(number)) + 1
+        number_of_digits = len(str(number))
 
         def _resource_filename(prefix, i_):
             return f'{prefix}_{str(i_).zfill(number_of_digits)}.obj'
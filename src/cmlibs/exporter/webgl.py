@@ -3,6 +3,7 @@ Export an Argon document to WebGL documents suitable for scaffoldvuer.
 """
 import math
 import json
+import re
 
 from cmlibs.argon.argondocument import ArgonDocument
 from cmlibs.exporter.base import BaseExporter
@@ -181,15 +182,13 @@ class ArgonSceneExporter(BaseExporter):
         if number == 0:
             return
 
-        resources = []
         """Write out each graphics into a json file which can be rendered with ZincJS"""
-        for i in range(number):
-            resources.append(sceneSR.createStreamresourceMemory())
+        resources = [sceneSR.createStreamresourceMemory() for _ in range(number)]
 
         scene.write(sceneSR)
 
         # Calculate number of digits for resource filenames
-        number_of_digits = math.floor(math.log10(number)) + 1
+        number_of_digits = len(str(number))
 
         # Define resource filename based on prefix and index
         def _resource_filename(prefix, i_, tessellation_level=None):
@@ -199,8 +198,8 @@ class ArgonSceneExporter(BaseExporter):
 
         """Write out each resource into their own file"""
         resource_count = 0
-        for i in range(number):
-            result, buffer = resources[i].getBuffer()
+        for i, resource in enumerate(resources):
+            result, buffer = resource.getBuffer()
             if result != ZINC_OK:
                 print('some sort of error')
                 continue
@@ -213,14 +212,13 @@ class ArgonSceneExporter(BaseExporter):
 
             if i == 0:
                 # Replace memory_resource_# with corresponding filenames
-                for j in range(number - 1):
-                    """
-                    IMPORTANT: the replace name here is relative to your html page, so adjust it
-                    accordingly.
-                    """
-                    replaceName = f'"{_resource_filename(self._prefix, j + 1, self._tessellation_level)}"'
-                    old_name = '"memory_resource_' + str(j + 2) + '"'
-                    buffer = buffer.replace(old_name, replaceName, 1)
+                """
+                IMPORTANT: the replace name here is relative to your html page, so adjust it
+                accordingly.
+                """
+                replace_names = {f'"memory_resource_{j + 2}"': f'"{_resource_filename(self._prefix, j + 1, self._tessellation_level)}"'
+                                 for j in range(number - 1)}
+                buffer = re.sub(r'"memory_resource_\d+"', lambda m: replace_names.get(m.group(0), m.group(0)), buffer)
 
                 # Add default view object and settings object
                 view_obj = self._define_default_view_obj() if self._document else None
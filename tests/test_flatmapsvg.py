@@ -51,14 +51,14 @@ class Exporter(unittest.TestCase):
 class FindConnectedSet(unittest.TestCase):
 
     def test_simple(self):
-        null = [0, 0]
-        p1 = [1, 1]
-        p2 = [2, 2]
-        p3 = [3, 3]
-        p4 = [4, 4]
-        p5 = [5, 5]
-        p6 = [6, 6]
-        p7 = [7, 7]
+        null = 0j
+        p1 = complex(1, 1)
+        p2 = complex(2, 2)
+        p3 = complex(3, 3)
+        p4 = complex(4, 4)
+        p5 = complex(5, 5)
+        p6 = complex(6, 6)
+        p7 = complex(7, 7)
 
         c1 = [[p1, null, null, p2], [p2, null, null, p3], [p3, null, null, p4], [p4, null, null, p5]]
         c2 = [[p1, null, null, p2], [p2, null, null, p3], [p5, null, null, p6], [p6, null, null, p7]]
@@ -71,14 +71,14 @@ class FindConnectedSet(unittest.TestCase):
         self.assertEqual(p1, segmented_c3[0][0][0])
 
     def test_real_data(self):
-        null = [0, 0]
-        p1 = [-38.76407990290047, 136.95711038948954]
-        p2 = [-38.66539406842079, 135.3388544011657]
-        p3 = [-38.66539406842079, 135.3388544011657]
-        p4 = [-38.57638526850839, 133.768421782719]
-        p5 = [-38.57638526850839, 133.768421782719]
-        p6 = [-38.50103491179091, 132.19996302635846]
-        p7 = [-38.5010349117909, 132.1999630263585]
+        null = 0j
+        p1 = complex(-38.76407990290047, 136.95711038948954)
+        p2 = complex(-38.66539406842079, 135.3388544011657)
+        p3 = complex(-38.66539406842079, 135.3388544011657)
+        p4 = complex(-38.57638526850839, 133.768421782719)
+        p5 = complex(-38.57638526850839, 133.768421782719)
+        p6 = complex(-38.50103491179091, 132.19996302635846)
+        p7 = complex(-38.5010349117909, 132.1999630263585)
 
         c1 = [[p1, null, null, p2], [p2, null, null, p3], [p3, null, null, p4], [p4, null, null, p5]]
         c2 = [[p1, null, null, p2], [p2, null, null, p3], [p5, null, null, p6], [p6, null, null, p7]]
@@ -92,29 +92,59 @@ class FindConnectedSet(unittest.TestCase):
         self.assertEqual(p2, segmented_c3[0][0][0])
 
     def test_real_data_single_section(self):
-        null = [0, 0]
-        p1 = [-38.76407990290047, 136.95711038948954]
-        p2 = [-38.66539406842078, 135.33885440116572]
-        p3 = [-38.66539406842079, 135.3388544011657]
-        p4 = [-38.57638526850839, 133.76842178271903]
-        p5 = [-38.57638526850839, 133.768421782719]
-        p6 = [-38.50103491179091, 132.19996302635846]
-        p7 = [-38.5010349117909, 132.1999630263585]
+        null = 0j
+        p1 = complex(-38.76407990290047, 136.95711038948954)
+        p2 = complex(-38.66539406842078, 135.33885440116572)
+        p3 = complex(-38.66539406842079, 135.3388544011657)
+        p4 = complex(-38.57638526850839, 133.76842178271903)
+        p5 = complex(-38.57638526850839, 133.768421782719)
+        p6 = complex(-38.50103491179091, 132.19996302635846)
+        p7 = complex(-38.5010349117909, 132.1999630263585)
 
         c1 = [[p1, null, null, p2], [p2, null, null, p3], [p3, null, null, p4], [p4, null, null, p5], [p6, null, null, p7]]
 
         self.assertEqual(2, len(_connected_segments(c1)))
 
     def test_real_data_fork(self):
-        null = [0, 0]
-        p1 = [-38.76407990290047, 136.95711038948954]
-        p2 = [-38.66539406842078, 135.33885440116572]
-        p3 = [-38.66539406842079, 135.3388544011657]
-        p4 = [-38.57638526850839, 133.76842178271903]
-        p5 = [-38.57638526850839, 133.768421782719]
-        p6 = [-38.50103491179091, 132.19996302635846]
-        p7 = [-38.5010349117909, 132.1999630263585]
+        null = 0j
+        p1 = complex(-38.76407990290047, 136.95711038948954)
+        p2 = complex(-38.66539406842078, 135.33885440116572)
+        p3 = complex(-38.66539406842079, 135.3388544011657)
+        p4 = complex(-38.57638526850839, 133.76842178271903)
+        p5 = complex(-38.57638526850839, 133.768421782719)
+        p6 = complex(-38.50103491179091, 132.19996302635846)
+        p7 = complex(-38.5010349117909, 132.1999630263585)
 
         c1 = [[p1, null, null, p2], [p2, null, null, p3], [p3, null, null, p4], [p4, null, null, p5], [p3, null, null, p6], [p6, null, null, p7]]
 
         self.assertEqual(2, len(_connected_segments(c1)))
+
+    def test_closed_loop(self):
+        null = 0j
+        p1 = complex(1, 1)
+        p2 = complex(2, 2)
+        p3 = complex(3, 3)
+        p4 = complex(4, 4)
+        p5 = complex(5, 5)
+
+        c1 = [[p2, null, null, p3], [p3, null, null, p1], [p1, null, null, p2]]
+        c2 = [[p1, null, null, p2], [p2, null, null, p3], [p3, null, null, p1], [p4, null, null, p5]]
+
+        segmented_c1 = _connected_segments(c1)
+        self.assertEqual(1, len(segmented_c1))
+        self.assertEqual(3, len(segmented_c1[0]))
+        segmented_c2 = _connected_segments(c2)
+        self.assertEqual(2, len(segmented_c2))
+        self.assertEqual(p1, segmented_c2[0][0][0])
+        self.assertEqual(p4, segmented_c2[1][0][0])
+
+    def test_real_data_truncation_boundary(self):
+        null = 0j
+        p1 = complex(-45.42283218243054, -223.1414195176321)
+        p2 = complex(-47.512220531969994, -143.90914477762553)
+        p3 = complex(-47.51222053197002, -143.9091447776255)
+        p4 = complex(-27.1656425864602, -104.5868633305504)
+
+        c1 = [[p1, null, null, p2], [p3, null, null, p4]]
+
+        self.assertEqual(1, len(_connected_segments(c1)))